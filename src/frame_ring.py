@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+# Shared memory ring of decoded frames, written by the capture worker and read by any number of
+# local consumers (previews, inference jobs, recorders) without opening another RTSP session.
+#
+# Layout: a header of int64 fields followed by slot_count slots, each made of a small int64 slot
+# header (sequence number, height, width, channels) and max_frame_bytes of pixel data. The writer
+# marks a slot as busy (sequence -1) while copying a frame in, then stamps it with the new sequence
+# number and publishes that number in the ring header. Readers never take a lock, they look up the
+# latest sequence number, map its slot as a read-only NumPy view and afterwards call is_valid() to
+# check the slot was not recycled while they were using it. A slow reader can therefore never block
+# the writer, it simply misses frames.
+#
+# The header also records the writer's PID and a generation stamp. A writer marks its ring retired
+# when it closes, or when a new writer reclaims a block left behind by a dead one, so readers can
+# tell via is_retired() that no new frames will arrive and they should attach to the name again.
+#
+# Example consumer:
+#	reader = FrameRingReader("camera_controller_frames")
+#	while True:
+#		if reader.is_retired():  # writer restarted, attach to the new ring
+#			reader.close()
+#			reader = FrameRingReader("camera_controller_frames")
+#		seq, frame = reader.latest()
+#		if frame is not None:
+#			result = model(frame)
+#			if not reader.is_valid(seq):  # frame was overwritten while in use, discard result
+#				result = None
+#		del frame
+
+RING_MAGIC = 0x46524D52494E4731  # "FRMRING1"
+RING_HEADER_FIELDS = 7  # magic, slot count, max frame bytes, latest sequence number, writer pid, generation, retired
+SLOT_HEADER_FIELDS = 4  # sequence number, height, width, channels
+FIELD_BYTES = 8
+
+
+def _slot_stride(max_frame_bytes):
+	return SLOT_HEADER_FIELDS * FIELD_BYTES + max_frame_bytes
+
+
+def _ring_size(slot_count, max_frame_bytes):
+	return RING_HEADER_FIELDS * FIELD_BYTES + slot_count * _slot_stride(max_frame_bytes)
+
+
+def _pid_alive(pid):
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except PermissionError:  # exists but belongs to another user
+		return True
+	return True
+
+
+class FrameRing:
+	def __init__(self, shm):
+		self.shm = shm
+		if shm.size < RING_HEADER_FIELDS * FIELD_BYTES:
+			raise ValueError("shared memory block \"{}\" is not a frame ring".format(shm.name))
+		self.header = np.ndarray((RING_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+		if self.header[0] != RING_MAGIC:
+			raise ValueError("shared memory block \"{}\" is not a frame ring".format(shm.name))
+		self.slot_count = int(self.header[1])
+		self.max_frame_bytes = int(self.header[2])
+		stride = _slot_stride(self.max_frame_bytes)
+		self.slot_headers = []
+		self.slot_offsets = []
+		for i in range(self.slot_count):
+			offset = RING_HEADER_FIELDS * FIELD_BYTES + i * stride
+			self.slot_headers.append(np.ndarray((SLOT_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=offset))
+			self.slot_offsets.append(offset + SLOT_HEADER_FIELDS * FIELD_BYTES)
+
+	@property
+	def name(self):
+		return self.shm.name
+
+	@property
+	def writer_pid(self):
+		return int(self.header[4])
+
+	@property
+	def generation(self):
+		return int(self.header[5])
+
+	def latest_seq(self):
+		return int(self.header[3])
+
+	def is_retired(self):
+		return self.header[6] != 0
+
+
+class FrameRingWriter(FrameRing):
+	def __init__(self, name, slot_count=4, max_frame_bytes=3840 * 2160 * 3):
+		size = _ring_size(slot_count, max_frame_bytes)
+		try:
+			shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+		except FileExistsError:
+			self._reclaim(name)
+			shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+		header = np.ndarray((RING_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+		header[:] = [RING_MAGIC, slot_count, max_frame_bytes, 0, os.getpid(), time.time_ns(), 0]
+		del header
+		super().__init__(shm)
+
+	@staticmethod
+	def _reclaim(name):
+		# Only replaces a ring left behind by a writer that is no longer running
+		stale = shared_memory.SharedMemory(name=name)
+		try:
+			ring = FrameRing(stale)
+		except ValueError:
+			stale.close()
+			raise FileExistsError("shared memory block \"{}\" exists and is not a frame ring".format(name))
+		writer_pid = ring.writer_pid
+		if not ring.is_retired() and writer_pid != os.getpid() and _pid_alive(writer_pid):
+			del ring
+			stale.close()
+			raise FileExistsError("frame ring \"{}\" is still in use by pid {}".format(name, writer_pid))
+		# Tell readers still attached to the old block that it will never get new frames
+		ring.header[6] = 1
+		del ring
+		stale.close()
+		stale.unlink()
+
+	def publish(self, frame):
+		if frame.dtype != np.uint8 or frame.nbytes > self.max_frame_bytes:
+			raise ValueError("frame {} {} does not fit in a {} byte ring slot".format(
+				frame.shape, frame.dtype, self.max_frame_bytes))
+		seq = self.latest_seq() + 1
+		slot = self.slot_headers[seq % self.slot_count]
+		height, width = frame.shape[:2]
+		channels = frame.shape[2] if frame.ndim == 3 else 1
+
+		# Mark the slot busy so readers holding its previous frame see it as invalid
+		slot[0] = -1
+		data = np.ndarray(frame.shape, dtype=np.uint8, buffer=self.shm.buf, offset=self.slot_offsets[seq % self.slot_count])
+		np.copyto(data, frame)
+		slot[1:] = [height, width, channels]
+		slot[0] = seq
+		self.header[3] = seq
+		return seq
+
+	def close(self):
+		self.header[6] = 1
+		self.header = None
+		self.slot_headers = []
+		self.shm.close()
+		self.shm.unlink()
+
+
+class FrameRingReader(FrameRing):
+	def __init__(self, name):
+		if sys.version_info >= (3, 13):
+			shm = shared_memory.SharedMemory(name=name, track=False)
+		else:
+			shm = shared_memory.SharedMemory(name=name)
+			# Stop the resource tracker from unlinking the writer's block when this reader exits
+			resource_tracker.unregister(shm._name, "shared_memory")
+		super().__init__(shm)
+
+	def latest(self):
+		# Returns (seq, frame) for the newest frame, frame is a read-only view into shared memory
+		seq = self.latest_seq()
+		if seq == 0 or self.is_retired():
+			return 0, None
+		slot = self.slot_headers[seq % self.slot_count]
+		height, width, channels = (int(v) for v in slot[1:])
+		if slot[0] != seq:  # writer has already moved on to this slot again
+			return 0, None
+		shape = (height, width, channels) if channels > 1 else (height, width)
+		frame = np.ndarray(shape, dtype=np.uint8, buffer=self.shm.buf, offset=self.slot_offsets[seq % self.slot_count])
+		frame.flags.writeable = False
+		if not self.is_valid(seq):
+			return 0, None
+		return seq, frame
+
+	def is_valid(self, seq):
+		return seq > 0 and self.slot_headers[seq % self.slot_count][0] == seq
+
+	def close(self):  # all views returned by latest() must be released first
+		self.header = None
+		self.slot_headers = []
+		self.shm.close()
@@ -1,16 +1,29 @@
+import argparse
 import atexit
+import contextlib
+import cProfile
+import faulthandler
 import logging
 import logging.handlers
+import multiprocessing
 import os
+import pstats
+import signal
 import sys
 import time
 import traceback
+import tracemalloc
 from datetime import datetime, timedelta, date
 
 import cv2
 import numpy as np
 import schedule
 
+from frame_ring import FrameRingWriter
+
+TIMING_STAGES = ["connect", "grab", "retrieve", "encode", "write"]
+LINK_STATS = ["failures", "frames", "last_frame_at", "outage_sum", "interval_count", "interval_sum", "interval_sq_sum", "nominal_fps"]
+
 
 def log(msg, level=logging.INFO):
 	logging.log(level, msg)
@@ -30,69 +43,478 @@ def setup_directories():
 	log("current file directory set as \"{}\"".format(current_dir))
 
 
-def capture_routine():
-	global camera_url, current_dir, capture_duration, photos_per_block
-	log("starting capture routine")
-	setup_directories()
+def open_camera(url):
+	global open_timeout, read_timeout
+	# Bound how long FFmpeg may block while opening the stream or waiting for a packet
+	params = [
+		cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, int(open_timeout * 1000),
+		cv2.CAP_PROP_READ_TIMEOUT_MSEC, int(read_timeout * 1000)
+	]
+	return cv2.VideoCapture(url, cv2.CAP_FFMPEG, params)
 
-	# Initialize routine variables
-	img_counter = 0
-	fail_counter = 0
-	now = datetime.now()
-	timestamp_str = now.strftime("%Y%m%d_%H") # Format the date and time into YYYYMMDD_HH
-	base_img_filename = "{}/{}00_snapshot".format(current_dir, timestamp_str)
-	photo_interval = np.floor((capture_duration / (photos_per_block + 1)) + photos_per_block)
 
-	# Initialize connection to camera and set up photo timing
-	cam = cv2.VideoCapture(camera_url)
+@contextlib.contextmanager
+def timed(timings, stage):
+	# Accumulates call count, total and max duration of a capture stage into the shared timings array
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		elapsed = time.perf_counter() - started
+		i = TIMING_STAGES.index(stage) * 3
+		timings[i] += 1
+		timings[i + 1] += elapsed
+		timings[i + 2] = max(timings[i + 2], elapsed)
+
+
+def format_timings(timings):
+	stage_strs = []
+	for i, stage in enumerate(TIMING_STAGES):
+		count, total, longest = timings[i * 3:i * 3 + 3]
+		if count > 0:
+			stage_strs.append("{} {:.0f}x avg {:.1f} ms max {:.1f} ms".format(
+				stage, count, total / count * 1000, longest * 1000))
+	return ", ".join(stage_strs) if stage_strs else "none recorded"
+
+
+def capture_loop(camera_url, transport, profile_label, base_img_filename, photo_interval, end_time, heartbeat, img_counter, fail_counter, reconnect_counter, timings, link_stats):
+	global frame_ring, adaptive_capture, read_timeout, max_grab_failures, outage_gap
+	# Runs in a child process, heartbeat is refreshed every time control returns from OpenCV
+	if transport is None:  # OpenCV's default, rtsp_flags=prefer_tcp
+		os.environ.pop("OPENCV_FFMPEG_CAPTURE_OPTIONS", None)
+	else:
+		os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;{}".format(transport)
+	heartbeat.value = time.time()
+	with timed(timings, "connect"):
+		cam = open_camera(camera_url)
+	heartbeat.value = time.time()
 	next_photo_time = datetime.now() + timedelta(seconds=photo_interval)
-	end_time = datetime.now() + timedelta(seconds=capture_duration)
+	last_frame_at = None
+	last_read_at = time.time()  # last successful grab, or the last (re)connect
+	grab_failures = 0  # consecutive failed grabs since the last good frame
 
-	# Main loop
+	# Main loop, frames are pulled continuously while the ring or the adaptive policy needs them
 	while datetime.now() < end_time:
-		if datetime.now() >= next_photo_time:
-			# Check if camera is operational
-			if not cam.isOpened():
+		heartbeat.value = time.time()
+		photo_due = datetime.now() >= next_photo_time
+		if not photo_due and frame_ring is None and not adaptive_capture:
+			continue
+
+		# Check if camera is operational
+		if not cam.isOpened():
+			if photo_due:
 				log("camera not open, trying to reconnect", logging.ERROR)
-				fail_counter += 1
-				cam = cv2.VideoCapture(camera_url)
-				continue
+				fail_counter.value += 1
+			link_stats[LINK_STATS.index("failures")] += 1
+			reconnect_counter.value += 1
+			last_frame_at = None
+			with timed(timings, "connect"):
+				cam = open_camera(camera_url)
+			last_read_at = time.time()
+			continue
 
-			# Grab frame from camera
-			success, frame = cam.read()
-			if not success:
+		# Grab frame from camera, it is only decoded into an image when someone will use it
+		with timed(timings, "grab"):
+			success = cam.grab()
+		if success and (photo_due or frame_ring is not None):
+			with timed(timings, "retrieve"):
+				success, frame = cam.retrieve()
+		if not success:
+			if photo_due:
 				log("failed to grab frame from camera feed", logging.WARNING)
-				fail_counter += 1
-				continue
+				fail_counter.value += 1
+			link_stats[LINK_STATS.index("failures")] += 1
+
+			# FFmpeg keeps a stalled session "open", so reconnect once reads have kept failing
+			grab_failures += 1
+			if grab_failures >= max_grab_failures or time.time() - last_read_at >= read_timeout:
+				log("camera feed stalled after {} failed grab(s), reconnecting".format(grab_failures), logging.ERROR)
+				reconnect_counter.value += 1
+				last_frame_at = None
+				cam.release()
+				heartbeat.value = time.time()
+				with timed(timings, "connect"):
+					cam = open_camera(camera_url)
+				last_read_at = time.time()
+				grab_failures = 0
+			continue
+		last_read_at = time.time()
+		grab_failures = 0
+
+		# Track frame arrival for the adaptive capture policy, failed opens, stalls and killed workers all
+		# show up as wall clock gaps between frames since last_frame_at is shared across workers
+		frame_gap = time.time() - link_stats[LINK_STATS.index("last_frame_at")]
+		if frame_gap > outage_gap:
+			link_stats[LINK_STATS.index("outage_sum")] += frame_gap
+		link_stats[LINK_STATS.index("last_frame_at")] = time.time()
+		link_stats[LINK_STATS.index("frames")] += 1
+		arrived_at = time.perf_counter()
+		if last_frame_at is None:
+			link_stats[LINK_STATS.index("nominal_fps")] = cam.get(cv2.CAP_PROP_FPS)
+		else:
+			interval = arrived_at - last_frame_at
+			link_stats[LINK_STATS.index("interval_count")] += 1
+			link_stats[LINK_STATS.index("interval_sum")] += interval
+			link_stats[LINK_STATS.index("interval_sq_sum")] += interval * interval
+		last_frame_at = arrived_at
+		if not photo_due and frame_ring is None:
+			continue
 
-			# Save snapshot of current frame
-			img_name = "{}{}.png".format(base_img_filename, img_counter + 1)
-			cv2.imwrite(img_name, frame)
-			log("snapshot taken, saved as \"{}\"".format(img_name))
+		# Fan the frame out to local consumers
+		if frame_ring is not None:
+			try:
+				frame_ring.publish(frame)
+			except ValueError as e:
+				log("disabling frame ring: {}".format(e), logging.ERROR)
+				frame_ring = None
+
+		# Save snapshot of current frame
+		if photo_due:
+			img_name = "{}{}.png".format(base_img_filename, img_counter.value + 1)
+			with timed(timings, "encode"):
+				success, png = cv2.imencode(".png", frame)
+			if not success:
+				log("failed to encode snapshot as png", logging.ERROR)
+				fail_counter.value += 1
+				continue
+			with timed(timings, "write"):
+				png.tofile(img_name)
+			log("snapshot taken with capture profile {}, saved as \"{}\"".format(profile_label, img_name))
 			next_photo_time = datetime.now() + timedelta(seconds=photo_interval)
-			img_counter += 1
+			img_counter.value += 1
+			last_frame_at = None  # encoding stalls the loop, keep it out of the arrival jitter and outages
+			link_stats[LINK_STATS.index("last_frame_at")] = time.time()
+
+	# Release resources
+	heartbeat.value = time.time()
+	cam.release()
+
+
+def capture_worker(*args):
+	# multiprocessing only prints a crashed child's traceback to stderr, so put it in the log as well
+	try:
+		run_capture_worker(*args)
+	except Exception:
+		log("capture worker failure due to exception:\n{}".format(traceback.format_exc()), logging.CRITICAL)
+		sys.exit(1)
+
+
+def run_capture_worker(profile_path, *args):
+	if profile_path is None:
+		capture_loop(*args)
+		return
+
+	# Profiled run, python stacks are dumped on SIGUSR1 so a hung worker still leaves a trace behind
+	stack_path = profile_path + "_stacks.txt"
+	stack_file = open(stack_path, "w")
+	faulthandler.register(signal.SIGUSR1, file=stack_file, all_threads=True)
+	tracemalloc.start()
+	profiler = cProfile.Profile()
+	profiler.enable()
+	try:
+		capture_loop(*args)
+	finally:
+		profiler.disable()
+		faulthandler.unregister(signal.SIGUSR1)
+		stack_file.close()
+		if os.path.getsize(stack_path) == 0:  # no hang was reported, nothing worth keeping
+			os.remove(stack_path)
+		peak_memory = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		profiler.dump_stats(profile_path + ".prof")
+
+		# Log the functions with the most time spent in their own body
+		stats = pstats.Stats(profiler).stats
+		hotspots = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:profile_top_n]
+		summary_str = "profile saved as \"{}.prof\", peak traced memory {:.1f} MiB, top hotspots:".format(
+			profile_path, peak_memory / 2 ** 20)
+		for (file_name, line, func), (_, calls, own_time, cum_time, _) in hotspots:
+			summary_str = summary_str + "\n\t{:.3f} sec own, {:.3f} sec cumulative, {} call(s) - {} ({}:{})".format(
+				own_time, cum_time, calls, func, os.path.basename(file_name), line)
+		log(summary_str)
+
+
+def start_capture_worker(*args):
+	worker = mp_context.Process(target=capture_worker, args=args, name="capture_worker", daemon=True)
+	worker.start()
+	log("capture worker started (pid {})".format(worker.pid))
+	return worker
+
+
+def worker_profile_path(base_path, worker_number):
+	return None if base_path is None else "{}_worker{}".format(base_path, worker_number)
+
+
+def stop_capture_worker(worker):
+	# SIGTERM first, SIGKILL if the worker is stuck somewhere that ignores it
+	worker.terminate()
+	worker.join(timeout=2)
+	if worker.is_alive():
+		worker.kill()
+		worker.join()
+
+
+def read_received_bytes():
+	# Bytes received on all non-loopback interfaces, the stream dominates this on the capture machine
+	try:
+		with open("/proc/net/dev", "r") as file:
+			lines = file.readlines()[2:]
+	except OSError:
+		return None
+	total = 0
+	for line in lines:
+		interface, counters = line.split(":", 1)
+		if interface.strip() != "lo":
+			total += int(counters.split()[0])
+	return total
+
+
+def measure_link(link_stats, hang_counter, block_started, block_rx_bytes):
+	global max_nominal_fps, outage_gap
+	# Everything is measured against the wall clock length of the block, so time lost to failed opens,
+	# stalled reads or hung workers counts against the link rather than disappearing
+	now = time.time()
+	block_elapsed = max(now - block_started, 1e-3)
+	outage = link_stats[LINK_STATS.index("outage_sum")]
+	trailing_gap = now - link_stats[LINK_STATS.index("last_frame_at")]
+	if trailing_gap > outage_gap:
+		outage += trailing_gap
+	outage_ratio = min(outage / block_elapsed, 1)
+
+	# Frame rate delivered over the whole block versus what the stream advertises
+	delivered_fps = link_stats[LINK_STATS.index("frames")] / block_elapsed
+	nominal_fps = link_stats[LINK_STATS.index("nominal_fps")]
+	if 0 < nominal_fps <= max_nominal_fps:
+		delivery_ratio = min(delivered_fps / nominal_fps, 1)
+	else:  # RTSP sources often advertise a bogus rate (e.g. the 90 kHz clock), judge by time connected
+		delivery_ratio = 1 - outage_ratio
+
+	# Jitter only looks at back to back frames, outages are already covered above
+	interval_count = link_stats[LINK_STATS.index("interval_count")]
+	variance = 0
+	if interval_count > 0:
+		mean_interval = link_stats[LINK_STATS.index("interval_sum")] / interval_count
+		variance = link_stats[LINK_STATS.index("interval_sq_sum")] / interval_count - mean_interval ** 2
+	return {
+		"outage_ratio": outage_ratio,
+		"delivered_fps": delivered_fps,
+		"delivery_ratio": delivery_ratio,
+		"received_kbps": block_rx_bytes * 8 / 1000 / block_elapsed if block_rx_bytes is not None else None,
+		"jitter_ms": np.sqrt(max(variance, 0)) * 1000,
+		"frames": int(link_stats[LINK_STATS.index("frames")]),
+		"failures": int(link_stats[LINK_STATS.index("failures")]),
+		"hangs": hang_counter,
+	}
+
+
+def adapt_capture_profile(link):
+	global capture_level, healthy_block_streak, degraded_block_streak, level_scores
+	global max_outage_ratio, min_delivery_ratio, max_jitter_ms, recovery_blocks, probe_blocks
+	degraded = (link["outage_ratio"] > max_outage_ratio
+		or link["delivery_ratio"] < min_delivery_ratio or link["jitter_ms"] > max_jitter_ms)
+	# Stepping back up needs clear headroom on every measurement so the policy does not flap
+	healthy = (link["hangs"] == 0 and link["outage_ratio"] <= max_outage_ratio / 2
+		and link["delivery_ratio"] >= (1 + min_delivery_ratio) / 2 and link["jitter_ms"] <= max_jitter_ms / 2)
+	score = 1 - link["outage_ratio"]  # share of the block that actually delivered frames
+
+	previous_level = capture_level
+	if link["frames"] == 0:
+		# A dead camera or a wrong stream path, a lighter profile can't fix that and may be the cause
+		healthy_block_streak = 0
+		degraded_block_streak = 0
+		capture_level = max(capture_level - 1, 0)
+		decision = "no frames at all, returning to a higher profile" if capture_level != previous_level else "no frames at all, holding"
+	elif degraded and capture_level > 0 and score < level_scores.get(capture_level - 1, 0):
+		healthy_block_streak = 0
+		degraded_block_streak = 0
+		capture_level -= 1
+		decision = "link degraded and doing worse than the profile above, returning to it"
+	elif degraded and capture_level == len(capture_profiles) - 1:
+		healthy_block_streak = 0
+		degraded_block_streak += 1
+		if capture_level > 0 and degraded_block_streak >= probe_blocks:
+			degraded_block_streak = 0
+			capture_level -= 1
+			decision = "link degraded at lightest profile for {} blocks, probing the profile above".format(probe_blocks)
+		else:
+			decision = "link degraded, already at lightest profile ({}/{} blocks before probing up)".format(
+				degraded_block_streak, probe_blocks)
+	elif degraded:
+		healthy_block_streak = 0
+		degraded_block_streak = 0
+		level_scores[capture_level] = score
+		capture_level += 1
+		decision = "link degraded, stepping down"
+	elif healthy:
+		degraded_block_streak = 0
+		healthy_block_streak += 1
+		if capture_level > 0 and healthy_block_streak >= recovery_blocks:
+			healthy_block_streak = 0
+			capture_level -= 1
+			decision = "link recovered, stepping up"
+		else:
+			decision = "link healthy, holding ({}/{} healthy blocks)".format(healthy_block_streak, recovery_blocks)
+	else:
+		healthy_block_streak = 0
+		degraded_block_streak = 0
+		decision = "link marginal, holding"
+
+	received_str = "{:.0f} kbps".format(link["received_kbps"]) if link["received_kbps"] is not None else "unknown"
+	log("adaptive capture: {} from {} to {} based on {:.0%} of block without frames, {:.1f} fps delivered at {:.0%} of nominal, "
+		"jitter {:.1f} ms, {} hang(s) (also seen: {} failed open(s)/grab(s), host received {})".format(
+		decision, format_capture_profile(previous_level), format_capture_profile(capture_level), link["outage_ratio"],
+		link["delivered_fps"], link["delivery_ratio"], link["jitter_ms"], link["hangs"], link["failures"], received_str),
+		logging.WARNING if capture_level > previous_level else logging.INFO)
+
+
+def build_capture_profiles():
+	global main_stream_path, sub_stream_path, udp_transport
+	# Capture profiles used by the adaptive policy, ordered from best quality to lightest on the uplink.
+	# Level 0 is the baseline: main stream with OpenCV's default transport (None, prefers tcp).
+	profiles = [{"stream": main_stream_path, "transport": None, "window": 1.0}]
+	if udp_transport:
+		profiles.append({"stream": main_stream_path, "transport": "udp", "window": 1.0})
+	lightest_stream = main_stream_path
+	if sub_stream_path is not None:
+		profiles.append({"stream": sub_stream_path, "transport": None, "window": 1.0})
+		lightest_stream = sub_stream_path
+	profiles.append({"stream": lightest_stream, "transport": None, "window": 0.5})
+	return profiles
+
+
+def format_capture_profile(level):
+	profile = capture_profiles[level]
+	transport = profile["transport"] if profile["transport"] is not None else "prefer_tcp"
+	return "{}/{}/{:.0%} window".format(profile["stream"], transport, profile["window"])
+
+
+def capture_routine():
+	global current_dir, capture_duration, photos_per_block, hang_timeout, block_counter, profile_every, profile_dir
+	global camera_base_url, adaptive_capture, capture_level, capture_profiles, max_worker_crashes, crash_backoff
+	log("starting capture routine")
+	setup_directories()
+	block_counter += 1
+	profile_block = profile_every > 0 and block_counter % profile_every == 0
+	capture_profile = capture_profiles[capture_level]
+	camera_url = "{}/{}".format(camera_base_url, capture_profile["stream"])
+	block_duration = capture_duration * capture_profile["window"]
+	log("capturing with profile {} from \"{}\"".format(format_capture_profile(capture_level), camera_url))
+
+	# Initialize routine variables (shared with the capture worker so they survive a kill)
+	img_counter = mp_context.Value("i", 0)
+	fail_counter = mp_context.Value("i", 0)
+	reconnect_counter = mp_context.Value("i", 0)
+	heartbeat = mp_context.Value("d", time.time())
+	timings = mp_context.Array("d", len(TIMING_STAGES) * 3, lock=False)  # only ever written by one worker at a time
+	link_stats = mp_context.Array("d", len(LINK_STATS), lock=False)
+	hang_counter = 0
+	crash_counter = 0
+	recovery_times = []  # seconds from a hung worker's last heartbeat to having a replacement running
+	hung_since = None
+	now = datetime.now()
+	timestamp_str = now.strftime("%Y%m%d_%H") # Format the date and time into YYYYMMDD_HH
+	base_img_filename = "{}/{}00_snapshot".format(current_dir, timestamp_str)
+	photo_interval = np.floor((block_duration / (photos_per_block + 1)) + photos_per_block)
+	end_time = datetime.now() + timedelta(seconds=block_duration)
+	block_started = time.time()
+	block_rx_start = read_received_bytes()
+	link_stats[LINK_STATS.index("last_frame_at")] = block_started
+	worker_args = (camera_url, capture_profile["transport"], format_capture_profile(capture_level), base_img_filename, photo_interval, end_time,
+		heartbeat, img_counter, fail_counter, reconnect_counter, timings, link_stats)
+	worker_counter = 0
+	profile_base_path = None
+	if profile_block:
+		log("profiling this capture block")
+		profile_base_path = "{}/{}00".format(profile_dir, timestamp_str)
+
+	# Supervise the capture worker, replacing it whenever it hangs or dies before the block ends
+	worker_counter += 1
+	worker = start_capture_worker(worker_profile_path(profile_base_path, worker_counter), *worker_args)
+	while worker is not None:
+		worker.join(timeout=1)
+		stalled_for = time.time() - heartbeat.value
+		if worker.is_alive() and stalled_for < hang_timeout:
+			continue
+
+		if worker.is_alive():
+			hung_since = heartbeat.value
+			log("capture worker (pid {}) unresponsive for {:.1f} sec, killing it".format(worker.pid, stalled_for), logging.ERROR)
+			if profile_block:  # have the worker dump its stacks before it goes
+				os.kill(worker.pid, signal.SIGUSR1)
+				time.sleep(0.5)
+			stop_capture_worker(worker)
+			hang_counter += 1
+		elif worker.exitcode != 0:
+			log("capture worker (pid {}) exited with code {}".format(worker.pid, worker.exitcode), logging.ERROR)
+			fail_counter.value += 1
+			crash_counter += 1
+			if crash_counter > max_worker_crashes:
+				log("capture worker crashed {} times, giving up on this block".format(crash_counter), logging.CRITICAL)
+				break
+			# Back off between crash respawns so a worker that dies on startup can't fork-storm the block
+			crash_delay = min(crash_backoff * 2 ** (crash_counter - 1), max(0, (end_time - datetime.now()).total_seconds()))
+			log("respawning capture worker in {:.0f} sec".format(crash_delay), logging.WARNING)
+			time.sleep(crash_delay)
+		else:
+			break
+
+		worker = None
+		if datetime.now() < end_time:
+			heartbeat.value = time.time()
+			worker_counter += 1
+			worker = start_capture_worker(worker_profile_path(profile_base_path, worker_counter), *worker_args)
+			if hung_since is not None:
+				recovery_times.append(time.time() - hung_since)
+		hung_since = None
 
 	# Log a small summary of errors encountered during routine
-	if img_counter == 0:
+	if img_counter.value == 0:
 		log("no images captured during routine", logging.ERROR)
 	else:
-		log("captured {} image(s) during routine".format(img_counter))
+		log("captured {} image(s) during routine".format(img_counter.value))
 
-	if fail_counter > 0:
-		log("encountered {} failure(s) during routine".format(fail_counter), logging.ERROR)
+	if fail_counter.value > 0:
+		log("encountered {} failure(s) during routine".format(fail_counter.value), logging.ERROR)
 	else:
 		log("no failures encountered during routine")
 
-	# Release resources
-	cam.release()
+	if reconnect_counter.value > 0:
+		log("reconnected to the camera {} time(s) during routine".format(reconnect_counter.value), logging.WARNING)
+
+	if crash_counter > 0:
+		log("capture worker crashed {} time(s) during routine".format(crash_counter), logging.ERROR)
+
+	if hang_counter > 0:
+		log("killed {} hung capture worker(s), {} respawned with a worst recovery time of {:.1f} sec".format(
+			hang_counter, len(recovery_times), max(recovery_times, default=0)), logging.ERROR)
+
+	log("capture stage timings: {}".format(format_timings(timings)))
+	if adaptive_capture:
+		block_rx_end = read_received_bytes()
+		block_rx_bytes = None
+		if block_rx_start is not None and block_rx_end is not None and block_rx_end >= block_rx_start:
+			block_rx_bytes = block_rx_end - block_rx_start
+		adapt_capture_profile(measure_link(link_stats, hang_counter, block_started, block_rx_bytes))
 	log("capture routine has concluded")
 
 
 def exit_handler():  # Can only be called via a SystemExit
+	if frame_ring is not None:
+		frame_ring.close()
 	log("exiting script...\n##################################################\n")
 
 
 if __name__ == '__main__':
+	# Command Line Arguments
+	parser = argparse.ArgumentParser(description="Takes scheduled snapshots from the RTSP camera")
+	parser.add_argument("--profile", action="store_true",
+		help="profile capture blocks with cProfile and tracemalloc, artifacts are saved next to the log file")
+	parser.add_argument("--profile-every", type=int, default=6, metavar="N",
+		help="with --profile, only profile every Nth capture block (default is 6, tracemalloc is costly)")
+	args = parser.parse_args()
+	if args.profile_every < 1:
+		parser.error("--profile-every must be at least 1")
+
 	# Script Configuration
 	verbose = True  # controls whether log msgs are printed to console (debugging)
 	capture_duration = 62  # seconds during which the camera is opened (default is 62 sec)
@@ -100,11 +522,44 @@ if __name__ == '__main__':
 	current_dir = ""  # global variable for where img files are currently being saved
 	data_dir = "/mnt/storage_1/PdM5g"  # base data location
 	log_path = "./capture_log.log"  # log file name and location
+	open_timeout = 10  # seconds FFmpeg may spend opening the stream before giving up
+	read_timeout = 5  # seconds FFmpeg may wait for a frame before giving up
+	max_grab_failures = 3  # consecutive failed grabs after which the camera is released and reopened
+	crash_backoff = 2  # seconds before respawning a crashed worker, doubled after every further crash in a block
+	max_worker_crashes = 5  # crashed workers tolerated per block before the block is abandoned
+	hang_timeout = 20  # seconds without a worker heartbeat before the worker is killed and respawned
+	publish_frames = True  # publishes decoded frames to a shared memory ring for other local consumers
+	frame_ring_name = "camera_controller_frames"  # shared memory name readers attach to
+	frame_ring_slots = 4  # frames kept in the ring, a reader must finish with a frame within this many frames
+	frame_ring_max_frame_bytes = 3840 * 2160 * 3  # largest frame the ring accepts (4K BGR)
+	profile_every = args.profile_every if args.profile else 0  # profile every Nth block, 0 disables profiling
+	profile_dir = os.path.join(os.path.dirname(log_path), "profiles")  # profile artifacts live next to the logs
+	profile_top_n = 10  # number of hotspots listed in each profile summary
+	block_counter = 0  # number of capture blocks started since the script launched
+	mp_context = multiprocessing.get_context("fork")  # worker inherits the configuration globals
 
 	# Camera Connection Configuration
 	ip_address = "174.90.198.126"
 	rtsp_port = "554"
-	camera_url = "rtsp://{}:{}/main".format(ip_address, rtsp_port)
+	camera_base_url = "rtsp://{}:{}".format(ip_address, rtsp_port)  # stream name is appended per capture profile
+
+	# Adaptive Capture Configuration
+	adaptive_capture = True  # measures the link every block and moves between capture profiles accordingly
+	main_stream_path = "main"  # full quality stream, what the script has always captured
+	sub_stream_path = None  # low bitrate stream path, e.g. "sub", leave None until confirmed for this camera
+	udp_transport = False  # also try forcing rtsp over udp, leave off if inbound udp rtp may be blocked
+	max_outage_ratio = 0.1  # share of the block spent without frames above which the link counts as degraded
+	outage_gap = 2  # seconds between frames after which the whole gap counts as an outage
+	min_delivery_ratio = 0.6  # share of the nominal frame rate that must actually arrive
+	max_jitter_ms = 250  # standard deviation of frame arrival intervals above which the link counts as degraded
+	max_nominal_fps = 120  # advertised frame rates above this are treated as unknown
+	recovery_blocks = 2  # consecutive healthy blocks required before stepping back up a profile
+	capture_level = 0  # index into capture_profiles, 0 is the baseline main stream profile
+	healthy_block_streak = 0  # consecutive healthy blocks seen at the current capture level
+	degraded_block_streak = 0  # consecutive degraded blocks seen at the lightest capture level
+	probe_blocks = 3  # degraded blocks at the lightest profile before probing the profile above
+	level_scores = {}  # share of the block with frames at each level the last time the policy stepped down from it
+	capture_profiles = build_capture_profiles()
 
 	# Schedule Configuration
 	schedule_times = [  # ranges from 5am to 12am inclusively
@@ -116,6 +571,11 @@ if __name__ == '__main__':
 	for t in schedule_times:
 		schedule.every().day.at(t).do(capture_routine)
 
+	frame_ring = None  # created once logging is up, see below
+
+	if profile_every > 0:
+		os.makedirs(profile_dir, exist_ok=True)
+
 	# Set up exit handler
 	atexit.register(exit_handler)
 
@@ -137,13 +597,31 @@ if __name__ == '__main__':
 
 	# Begin script
 	log("starting script...")
+
+	# Shared memory frame ring, created once so readers can stay attached across capture blocks.
+	# It is optional, so failing to create it must not stop snapshots from being taken.
+	if publish_frames:
+		try:
+			frame_ring = FrameRingWriter(frame_ring_name, frame_ring_slots, frame_ring_max_frame_bytes)
+		except (FileExistsError, OSError) as e:
+			log("frame ring unavailable, continuing without it: {}".format(e), logging.ERROR)
+
 	summary_str = "script variables:"
 	summary_str = summary_str + "\n\tverbose = {}".format(verbose)
 	summary_str = summary_str + "\n\tcapture_duration = {} sec".format(capture_duration)
 	summary_str = summary_str + "\n\tphotos_per_block = {}".format(photos_per_block)
 	summary_str = summary_str + "\n\tdata_directory = \"{}\"".format(data_dir)
+	summary_str = summary_str + "\n\topen_timeout = {} sec".format(open_timeout)
+	summary_str = summary_str + "\n\tread_timeout = {} sec".format(read_timeout)
+	summary_str = summary_str + "\n\tmax_grab_failures = {}".format(max_grab_failures)
+	summary_str = summary_str + "\n\thang_timeout = {} sec".format(hang_timeout)
+	summary_str = summary_str + "\n\tframe_ring = {}".format("\"{}\"".format(frame_ring.name) if frame_ring is not None else None)
+	summary_str = summary_str + "\n\tprofile_every = {}".format(profile_every)
 	summary_str = summary_str + "\n\tlog_path = \"{}\"".format(log_path)
-	summary_str = summary_str + "\n\tcamera_url = \"{}\"".format(camera_url)
+	summary_str = summary_str + "\n\tcamera_base_url = \"{}\"".format(camera_base_url)
+	summary_str = summary_str + "\n\tadaptive_capture = {}".format(adaptive_capture)
+	summary_str = summary_str + "\n\tcapture_profiles = {}".format(
+		", ".join(format_capture_profile(level) for level in range(len(capture_profiles))))
 	summary_str = summary_str + "\n\tnum_of_scheduled_jobs = {}".format(len(schedule.jobs))
 	log(summary_str)
 